@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+# Optional Numba-compiled versions of the hot kernels: distance, 2-opt improvement (full and
+# candidate list), and k-move application / adjacency walks. Kernels operate on typed arrays;
+# the wrappers below take and return the same list-based representations as the pure-Python reference implementations in
+# basic.py, two_opt.py and solver.py, and produce identical results.
+# distance is only compiled for use inside the other kernels: a per-pair call from Python costs
+# more in dispatch than it saves, so basic.distance stays pure Python.
+# If numba (and numpy) are not installed, AVAILABLE is False and callers use the reference path.
+
+import random
+
+try:
+    import numba
+    import numpy as np
+except ImportError:
+    numba = None
+
+AVAILABLE = numba is not None
+# when optimizing with a stop function, it is checked between batches of this many moves.
+STOP_CHECK_MOVES = 16
+
+if AVAILABLE:
+    @numba.njit(cache = True)
+    def distance_kernel(xy, i, j):
+        dx = xy[i, 0] - xy[j, 0]
+        dy = xy[i, 1] - xy[j, 1]
+        # rint rounds half to even, like the builtin round in basic.distance.
+        return int(np.rint((dx * dx + dy * dy) ** 0.5))
+
+    @numba.njit(cache = True)
+    def improve_kernel(xy, tour):
+        """First improving 2-opt move, in the same scan order as two_opt.improve.
+        Returns (i, j, improvement), with improvement 0 if there is none.
+        """
+        n = tour.shape[0]
+        for i in range(n):
+            ilen = distance_kernel(xy, tour[i], tour[(i + 1) % n])
+            for j in range(i + 2, n):
+                jlen = distance_kernel(xy, tour[j], tour[(j + 1) % n])
+                cost = distance_kernel(xy, tour[i], tour[j]) + distance_kernel(xy, tour[(i + 1) % n], tour[(j + 1) % n])
+                improvement = ilen + jlen - cost
+                if improvement > 0:
+                    return i, j, improvement
+        return 0, 0, 0
+
+    @numba.njit(cache = True)
+    def optimize_kernel(xy, tour, max_moves):
+        """Applies up to max_moves improve_kernel moves in place (until none remain if max_moves
+        is negative). Returns (total improvement, True if a 2-opt local optimum was reached).
+        """
+        total = 0
+        moves = 0
+        while moves != max_moves:
+            i, j, improvement = improve_kernel(xy, tour)
+            if improvement <= 0:
+                return total, True
+            tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1].copy()
+            total += improvement
+            moves += 1
+        return total, False
+
+    @numba.njit(cache = True)
+    def improve_candidates_kernel(xy, tour, position, candidates):
+        """First improving candidate 2-opt move, in the same scan order as
+        two_opt.improve_candidates. candidates is an (n, k) array padded with -1.
+        Returns (a, b, improvement): reversing positions a + 1 through b performs the move.
+        """
+        n = tour.shape[0]
+        for i in range(n):
+            t1 = tour[i]
+            for direction in (1, -1):
+                t2 = tour[(i + direction) % n]
+                d12 = distance_kernel(xy, t1, t2)
+                for c in range(candidates.shape[1]):
+                    t3 = candidates[t1, c]
+                    if t3 < 0:
+                        break
+                    d13 = distance_kernel(xy, t1, t3)
+                    if d13 >= d12:
+                        continue
+                    j = position[t3]
+                    t4 = tour[(j + direction) % n]
+                    improvement = d12 + distance_kernel(xy, t3, t4) - d13 - distance_kernel(xy, t2, t4)
+                    if improvement > 0:
+                        if direction == 1:
+                            a, b = i, j
+                        else:
+                            a, b = (i - 1) % n, (j - 1) % n
+                        return min(a, b), max(a, b), improvement
+        return 0, 0, 0
+
+    @numba.njit(cache = True)
+    def optimize_candidates_kernel(xy, tour, position, candidates, max_moves):
+        """Applies up to max_moves improve_candidates_kernel moves in place (until none remain if
+        max_moves is negative), keeping position (node id to tour position) up to date.
+        Returns (total improvement, True if a 2-opt local optimum was reached).
+        """
+        total = 0
+        moves = 0
+        while moves != max_moves:
+            a, b, improvement = improve_candidates_kernel(xy, tour, position, candidates)
+            if improvement <= 0:
+                return total, True
+            tour[a + 1:b + 1] = tour[a + 1:b + 1][::-1].copy()
+            for p in range(a + 1, b + 1):
+                position[tour[p]] = p
+            total += improvement
+            moves += 1
+        return total, False
+
+    @numba.njit(cache = True)
+    def walk_kernel(adjacency):
+        """Same walk as solver.walk_adjacency_map over an (n, 2) adjacency array."""
+        n = adjacency.shape[0]
+        tour = np.empty(n, dtype = np.int64)
+        start = 0
+        i = adjacency[start, 0]
+        prev = start
+        count = 0
+        while i != start:
+            tour[count] = i
+            count += 1
+            if adjacency[i, 0] == prev:
+                prev = i
+                i = adjacency[i, 1]
+            else:
+                prev = i
+                i = adjacency[i, 0]
+        tour[count] = i
+        count += 1
+        return tour[:count]
+
+    @numba.njit(cache = True)
+    def remove_neighbor(adjacency, degree, a, b):
+        if degree[a] == 2 and adjacency[a, 0] == b:
+            adjacency[a, 0] = adjacency[a, 1]
+        degree[a] -= 1
+
+    @numba.njit(cache = True)
+    def perform_kmove_kernel(tour, dels, adds):
+        """Same result as solver.perform_kmove: neighbor order in the adjacency array matches the
+        order of the reference adjacency lists, so the walk direction is identical.
+        """
+        n = tour.shape[0]
+        adjacency = np.empty((n, 2), dtype = np.int64)
+        degree = np.full(n, 2, dtype = np.int64)
+        for si in range(n):
+            adjacency[tour[si], 0] = tour[si - 1]
+            adjacency[tour[si], 1] = tour[(si + 1) % n]
+        for k in range(dels.shape[0]):
+            remove_neighbor(adjacency, degree, dels[k, 0], dels[k, 1])
+            remove_neighbor(adjacency, degree, dels[k, 1], dels[k, 0])
+        for k in range(adds.shape[0]):
+            a = adds[k, 0]
+            b = adds[k, 1]
+            assert degree[a] < 2 and degree[b] < 2
+            adjacency[a, degree[a]] = b
+            degree[a] += 1
+            adjacency[b, degree[b]] = a
+            degree[b] += 1
+        for i in range(n):
+            assert degree[i] == 2
+        return walk_kernel(adjacency)
+
+def xy_array(xy):
+    return np.asarray(xy, dtype = np.float64)
+
+def tour_array(tour):
+    return np.asarray(tour, dtype = np.int64)
+
+def edge_array(edges):
+    return np.asarray(list(edges), dtype = np.int64).reshape(-1, 2)
+
+def candidate_array(candidates):
+    """(n, k) array of candidate lists, with shorter lists padded with -1."""
+    k = max([len(c) for c in candidates])
+    array = np.full((len(candidates), k), -1, dtype = np.int64)
+    for i, c in enumerate(candidates):
+        array[i, :len(c)] = c
+    return array
+
+def distance(xy, i, j):
+    return distance_kernel(xy_array(xy), i, j)
+
+def improve(xy, tour):
+    """Accelerated two_opt.improve."""
+    i, j, improvement = improve_kernel(xy_array(xy), tour_array(tour))
+    if improvement <= 0:
+        return tour, 0
+    return tour[:i+1] + tour[j:i:-1] + tour[j+1:], improvement
+
+def run_in_batches(kernel, stop):
+    """Calls kernel(max_moves) until it reports a local optimum. If stop is given, it is checked
+    before each batch of STOP_CHECK_MOVES moves, and returning True ends the optimization early.
+    Returns total improvement.
+    """
+    if stop is None:
+        return kernel(-1)[0]
+    total = 0
+    while not stop():
+        improvement, done = kernel(STOP_CHECK_MOVES)
+        total += improvement
+        if done:
+            break
+    return total
+
+def optimize(xy, tour, stop = None):
+    """Accelerated 2-opt local optimum of two_opt.optimize (without the length report), with
+    stop checked as in run_in_batches. Returns a tuple of: new tour, total improvement.
+    """
+    t = tour_array(tour)
+    a = xy_array(xy)
+    improvement = run_in_batches(lambda max_moves: optimize_kernel(a, t, max_moves), stop)
+    return t.tolist(), improvement
+
+def improve_candidates(xy, tour, candidates):
+    """Accelerated two_opt.improve_candidates."""
+    t = tour_array(tour)
+    position = np.empty_like(t)
+    position[t] = np.arange(len(t))
+    a, b, improvement = improve_candidates_kernel(xy_array(xy), t, position, candidate_array(candidates))
+    if improvement <= 0:
+        return tour, 0
+    return tour[:a+1] + tour[b:a:-1] + tour[b+1:], improvement
+
+def optimize_candidates(xy, tour, candidates, stop = None):
+    """Accelerated candidate 2-opt local optimum of two_opt.optimize (without the length report),
+    with stop checked as in run_in_batches. Returns a tuple of: new tour, total improvement.
+    """
+    t = tour_array(tour)
+    a = xy_array(xy)
+    c = candidate_array(candidates)
+    position = np.empty_like(t)
+    position[t] = np.arange(len(t))
+    improvement = run_in_batches(lambda max_moves: optimize_candidates_kernel(a, t, position, c, max_moves), stop)
+    return t.tolist(), improvement
+
+def walk_adjacency_map(adjacency_map):
+    """Accelerated solver.walk_adjacency_map."""
+    adjacency = np.asarray([adjacency_map[i] for i in range(len(adjacency_map))], dtype = np.int64)
+    return walk_kernel(adjacency).tolist()
+
+def perform_kmove(tour, kmove):
+    """Accelerated solver.perform_kmove."""
+    return perform_kmove_kernel(tour_array(tour), edge_array(kmove['dels']), edge_array(kmove['adds'])).tolist()
+
+def check_backends(xy, trials = 20):
+    """Asserts that accelerated and reference kernels give identical results on random tours."""
+    import basic
+    import held_karp
+    import solver
+    import tour_util
+    import two_opt
+    assert(AVAILABLE)
+    n = len(xy)
+    candidates = held_karp.nearest_neighbors(xy, 8)
+    # ragged lists exercise the -1 padding of candidate_array.
+    ragged = [c[:random.randrange(1, 9)] for c in candidates]
+    for _ in range(trials):
+        tour = tour_util.default(xy)
+        random.shuffle(tour)
+        i, j = random.randrange(n), random.randrange(n)
+        assert(distance(xy, i, j) == basic.distance(xy, i, j))
+        assert(improve(xy, tour) == two_opt.improve_python(xy, tour))
+        optimized = optimize(xy, tour)
+        reference = tour
+        improvement = 0
+        while True:
+            reference, gain = two_opt.improve_python(xy, reference)
+            if gain == 0:
+                break
+            improvement += gain
+        assert(optimized == (reference, improvement))
+        # batched runs (stop never returns True) must reach the same optimum.
+        assert(optimize(xy, tour, lambda: False) == optimized)
+        assert(optimize(xy, tour, lambda: True) == (tour, 0))
+        for c in (candidates, ragged):
+            assert(improve_candidates(xy, tour, c) == two_opt.improve_candidates_python(xy, tour, c))
+            optimized = optimize_candidates(xy, tour, c)
+            reference = tour
+            improvement = 0
+            while True:
+                reference, gain = two_opt.improve_candidates_python(xy, reference, c)
+                if gain == 0:
+                    break
+                improvement += gain
+            assert(optimized == (reference, improvement))
+            assert(optimize_candidates(xy, tour, c, lambda: False) == optimized)
+        adjacency_map = solver.make_adjacency_map(tour)
+        assert(walk_adjacency_map(adjacency_map) == solver.walk_adjacency_map_python(adjacency_map))
+        perturbed = two_opt.optimize(xy, tour_util.double_bridge(reference))[0]
+        common, dels, adds = tour_util.factor(reference, perturbed)
+        kmove = {'dels': list(dels), 'adds': list(adds)}
+        assert(perform_kmove(reference, kmove) == solver.perform_kmove_python(reference, kmove))
+        for k in solver.segments_to_kmoves(solver.Splitter(reference, perturbed).get_segments()):
+            # independent k-moves can be infeasible alone, exercising walks that close early.
+            assert(perform_kmove(reference, k) == solver.perform_kmove_python(reference, k))
+
+if __name__ == "__main__":
+    import reader
+    if not AVAILABLE:
+        print('numba not available; using pure-Python kernels.')
+    else:
+        check_backends(reader.read_xy("problems/xqf131.tsp"))
+        print('accelerated and reference kernels agree.')
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Library interface to the perturbed hill climb: an anytime solver that can be advanced by a
+# number of iterations or until a deadline, cancelled from another thread, and streamed from
+# asyncio code while the search runs in a worker thread.
+
+import asyncio
+import held_karp
+import reader
+import solver
+import threading
+import time
+import tour_util
+import two_opt
+
+class AnytimeSolver:
+    """Holds the best tour found so far. All methods are safe to call from other threads while
+    run is in progress; the search itself should only be driven by one thread at a time.
+    """
+    def __init__(self, xy, tour = None, candidates = None, bound = None, max_gap = 0):
+        """tour defaults to tour_util.default(xy), and is 2-optimized on the first iteration.
+        candidates are passed to two_opt.optimize; bound (e.g. from held_karp) and max_gap
+        define when the search is done.
+        """
+        self.xy = xy
+        self.candidates = candidates
+        self.bound = bound
+        self.max_gap = max_gap
+        self.tour = tour_util.default(xy) if tour is None else tour[:]
+        self.length = tour_util.length(xy, self.tour)
+        self.optimized = False
+        self.iterations = 0
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+    def best(self):
+        """Returns a tuple of: copy of the best tour, and its length."""
+        with self.lock:
+            return self.tour[:], self.length
+
+    def done(self):
+        """True if cancelled, or if the best tour is within max_gap of the lower bound."""
+        if self.cancelled.is_set():
+            return True
+        return self.bound is not None and held_karp.gap(self.length, self.bound) <= self.max_gap
+
+    def cancel(self):
+        """Stops step or run after the current 2-opt move. Stays in effect until reset."""
+        self.cancelled.set()
+
+    def reset(self):
+        """Clears a previous cancel, so the search can be resumed."""
+        self.cancelled.clear()
+
+    def iterate(self, stop = None):
+        """Performs one iteration, abandoning it early if stop() returns True.
+        Returns True if the best tour improved.
+        """
+        if not self.optimized:
+            tour, length = two_opt.optimize(self.xy, self.tour, self.candidates, False, stop)
+            # if stopped, the tour is improved but not yet 2-optimal; continue next iteration.
+            self.optimized = not (stop and stop())
+        else:
+            tour, length = solver.perturbation_step(self.xy, self.tour, self.length, self.candidates, False, stop)
+        self.iterations += 1
+        if length >= self.length:
+            return False
+        with self.lock:
+            self.tour = tour
+            self.length = length
+        return True
+
+    def step(self, budget = 1, on_improvement = None, deadline = None):
+        """Performs up to budget iterations, stopping early if cancelled or once
+        time.monotonic() passes deadline (None means no deadline). Returns the best tour and
+        length, as in best.
+        """
+        def stop():
+            return self.cancelled.is_set() or (deadline is not None and time.monotonic() >= deadline)
+        for _ in range(budget):
+            if self.done() or stop():
+                break
+            if self.iterate(stop) and on_improvement:
+                on_improvement(*self.best())
+        return self.best()
+
+    def run(self, deadline = None, on_improvement = None):
+        """Iterates until done or time.monotonic() passes deadline (None means no deadline).
+        The deadline and cancellation are also checked between 2-opt moves within an iteration,
+        so they are overrun by at most one 2-opt move evaluation (accel.STOP_CHECK_MOVES moves with
+        the compiled kernels).
+        Returns the best tour and length, as in best.
+        """
+        while not self.done():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self.step(1, on_improvement, deadline)
+        return self.best()
+
+    async def improvements(self, deadline = None, executor = None):
+        """Async generator yielding (tour, length) for the initial tour and each improvement, while
+        run(deadline) executes in executor (default: the event loop's thread pool).
+        Clears any previous cancel before starting. Closing the generator early or cancelling the
+        consuming task cancels the search; ending normally (deadline or gap reached) does not.
+        """
+        self.reset()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        def report(tour, length):
+            loop.call_soon_threadsafe(queue.put_nowait, (tour, length))
+        worker = loop.run_in_executor(executor, self.run, deadline, report)
+        worker.add_done_callback(lambda f: queue.put_nowait(None))
+        try:
+            yield self.best()
+            while True:
+                improvement = await queue.get()
+                if improvement is None:
+                    break
+                yield improvement
+            # surface exceptions raised by the search.
+            await worker
+        finally:
+            if not worker.done():
+                # closed early, or the consumer raised: stop the worker thread.
+                self.cancel()
+
+def solve(xy, seconds, candidates = None, bound = None, max_gap = 0):
+    """Blocking convenience wrapper: best tour and length found within the given time."""
+    return AnytimeSolver(xy, None, candidates, bound, max_gap).run(time.monotonic() + seconds)
+
+if __name__ == "__main__":
+    xy = reader.read_xy("problems/xqf131.tsp")
+    bound, candidates = held_karp.bound_and_candidates(xy)
+    async def stream():
+        anytime_solver = AnytimeSolver(xy, None, candidates, bound)
+        async for tour, length in anytime_solver.improvements(time.monotonic() + 10):
+            print('{} (gap {:.4%})'.format(length, held_karp.gap(length, bound)))
+    asyncio.run(stream())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Batch solving of many small instances on a persistent process pool.
+# Workers are started once, import the solver modules and warm the compiled kernels (if accel is
+# available) in their initializer, and then solve instances as they arrive. Results are yielded
+# in completion order. A failing instance is reported in its result, and does not stop the batch.
+
+import accel
+import anytime
+import glob
+import held_karp
+import multiprocessing
+import random
+import reader
+import solver
+import sys
+import time
+import tour_util
+
+# settings of the current worker process, set by init_worker.
+worker_settings = {}
+# smallest instance the perturbation (tour_util.double_bridge) supports.
+MIN_NODES = 6
+
+def init_worker(settings):
+    worker_settings.update(settings)
+    # forked workers inherit the parent's random state; reseed so they explore differently.
+    random.seed()
+    if accel.AVAILABLE:
+        # triggers compilation (or loading from the cache) of the kernels solve_instance uses,
+        # by solving a small instance the same way, before the first real instance arrives.
+        # seconds is ignored, so that warm-up is not a full search. Whether an iteration applies a
+        # k-move is random, so the k-move kernel is also warmed directly.
+        xy = [(float(i % 4), float(i // 4 + i % 3)) for i in range(16)]
+        tour, length = solve(xy, 1, None)
+        common, dels, adds = tour_util.factor(tour, tour_util.double_bridge(tour))
+        solver.perform_kmove(tour, {'dels': list(dels), 'adds': list(adds)})
+
+def load(instance):
+    """instance is either a TSPLIB file path, or a sequence of (x, y) coordinates."""
+    if isinstance(instance, str):
+        return reader.read_xy(instance)
+    return [(float(p[0]), float(p[1])) for p in instance]
+
+def solve(xy, iterations, seconds):
+    """Returns the best tour and length found in iterations perturbation steps, or in seconds of
+    search if seconds is not None.
+    """
+    candidates = held_karp.nearest_neighbors(xy, worker_settings['candidate_count'])
+    solver = anytime.AnytimeSolver(xy, None, candidates)
+    if seconds is not None:
+        return solver.run(time.monotonic() + seconds)
+    # the first iteration only 2-optimizes the initial tour.
+    return solver.step(iterations + 1)
+
+def solve_instance(indexed_instance):
+    """Worker entry point. Returns a tuple of: instance index, best tour, and its length.
+    If the instance cannot be solved, returns (index, None, error message) instead.
+    """
+    index, instance = indexed_instance
+    try:
+        xy = load(instance)
+        if len(xy) < MIN_NODES:
+            raise ValueError('instance has {} nodes, at least {} are required'.format(len(xy), MIN_NODES))
+        tour, length = solve(xy, worker_settings['iterations'], worker_settings['seconds'])
+        return index, tour, length
+    except Exception as e:
+        # a message rather than the exception, which may not be picklable.
+        return index, None, '{}: {}'.format(type(e).__name__, e)
+
+class BatchSolver:
+    """Persistent pool of solver processes. Use as a context manager, or call close."""
+    def __init__(self, processes = None, iterations = 20, seconds = None, candidate_count = 8, chunksize = 4):
+        """Each instance gets iterations perturbation steps, or seconds of search if given.
+        2-opt uses the candidate_count nearest neighbors of each node.
+        chunksize instances are sent to a worker at a time, amortizing inter-process overhead.
+        """
+        settings = {'iterations': iterations, 'seconds': seconds, 'candidate_count': candidate_count}
+        self.chunksize = chunksize
+        self.pool = multiprocessing.Pool(processes, init_worker, (settings,))
+
+    def solve(self, instances):
+        """Generator yielding (index, tour, length) as instances complete, where index is the
+        position of the instance in instances. instances may be a lazy iterable.
+        For an instance that failed, tour is None and length is the error message.
+        """
+        for result in self.pool.imap_unordered(solve_instance, enumerate(instances), self.chunksize):
+            yield result
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.pool.terminate()
+        self.pool.join()
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or sorted(glob.glob("problems/*.tsp"))
+    start = time.monotonic()
+    with BatchSolver() as batch_solver:
+        for index, tour, length in batch_solver.solve(paths):
+            if tour is None:
+                print('{}: failed ({})'.format(paths[index], length))
+            else:
+                print('{}: {}'.format(paths[index], length))
+    elapsed = time.monotonic() - start
+    print('{} instances in {:.2f}s ({:.2f} instances/s)'.format(len(paths), elapsed, len(paths) / elapsed))
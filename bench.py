@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+# Microbenchmarks for each pipeline stage, on synthetic tours and diffs of controlled size:
+# n is the instance size, and k the number of edges in the diff between 2 tours.
+# Measures scaling curves, checks fitted exponents against the expected asymptotic behavior,
+# compares timings against a stored baseline, and optionally writes cProfile output per stage
+# (.prof files, which flameprof / snakeviz turn into flamegraphs).
+#
+# usage: bench.py [--save-baseline FILE] [--compare FILE] [--profile-dir DIR] [--stage NAME] [--quick]
+# Timings depend on whether the compiled accel kernels are available; compare like with like.
+
+import accel
+import argparse
+import cProfile
+import copy
+import gc
+import json
+import math
+import os
+import random
+import solver
+import sys
+import tempfile
+import time
+import tour_util
+import two_opt
+import reader
+from splitter import Splitter
+
+# timings slower than baseline by this factor, and fitted exponents further than
+# EXPONENT_TOLERANCE from the expected one, are flagged if CONFIRMATIONS re-measurements on the
+# same inputs agree.
+REGRESSION_FACTOR = 1.5
+CONFIRMATIONS = 2
+# allowed difference between fitted and expected scaling exponents.
+EXPONENT_TOLERANCE = 0.4
+REPEAT = 7
+# fast stages are called repeatedly per timing, up to MAX_NUMBER times, to reduce timer noise.
+MIN_TIME = 0.05
+MAX_NUMBER = 5000
+N_SIZES = [500, 1000, 2000, 4000]
+K_SIZES = [64, 128, 256, 512]
+FIXED_N = 8000
+FIXED_K = 64
+# double bridges of a diff are placed in blocks of this many tour nodes.
+PATTERN_SPAN = 24
+# two_opt.improve does a full O(n^2) scan; keep its sizes small.
+IMPROVE_SIZES = [100, 200, 400]
+
+def random_xy(n):
+    return [(random.uniform(0, 1000), random.uniform(0, 1000)) for _ in range(n)]
+
+def convex_xy(n):
+    """Points on a circle: tour_util.default is 2-optimal, so two_opt.improve scans all pairs."""
+    return [(1000 * math.cos(2 * math.pi * i / n), 1000 * math.sin(2 * math.pi * i / n)) for i in range(n)]
+
+def diff_pattern(k):
+    """k // 4 double bridges, as (p, a, c, d) cut offsets within a block of PATTERN_SPAN nodes.
+    Each double bridge reorders tour segments A B C into C B A. A or C is randomly a single node,
+    making that node a junction (2 deletions and 2 additions), so the diff has trivial and
+    acyclic segments as well as independent k-moves. B has at least 2 nodes, otherwise an
+    added edge could coincide with a deleted one.
+    The pattern only depends on k, so that diffs of the same k have the same segment structure
+    regardless of n.
+    """
+    rng = random.Random(k)
+    pattern = []
+    for _ in range(k // 4):
+        p, a, c, d = sorted(rng.sample(range(PATTERN_SPAN - 3), 4))
+        c += 1
+        d += 2
+        if rng.random() < 0.5:
+            a = p + 1
+        if rng.random() < 0.5:
+            c = d - 1
+        pattern.append((p, a, c, d))
+    return pattern
+
+def perturbed(tour, k):
+    """Applies diff_pattern(k) in disjoint blocks spread evenly over the tour, so the diff has
+    k edges.
+    """
+    pattern = diff_pattern(k)
+    block = len(tour) // len(pattern)
+    assert(block >= PATTERN_SPAN)
+    new_tour = tour[:]
+    for b, (p, a, c, d) in enumerate(pattern):
+        p, a, c, d = [x + b * block for x in (p, a, c, d)]
+        new_tour[p + 1:d + 1] = tour[c + 1:d + 1] + tour[a + 1:c + 1] + tour[p + 1:a + 1]
+    return new_tour
+
+def diff(n, k):
+    """Random instance tour, and a tour differing from it by k edges."""
+    tour = tour_util.default(random_xy(n))
+    random.shuffle(tour)
+    new_tour = perturbed(tour, k)
+    assert(len(tour_util.factor(tour, new_tour)[1]) == k)
+    return tour, new_tour
+
+def consume_inputs(segments):
+    """Inputs of solver.consume_all_trivials, prepared as in solver.segments_to_kmoves."""
+    trivials = [s for s in segments if solver.is_cyclic(s) and not solver.is_balanced(s)]
+    other = [s for s in segments if not solver.is_cyclic(s)]
+    kmoves, trivials = solver.merge_trivial_segments(trivials)
+    return other, trivials
+
+def write_instance(xy, directory):
+    path = os.path.join(directory, 'bench{}.tsp'.format(len(xy)))
+    with open(path, "w") as f:
+        f.write("NAME : bench{}\nTYPE : TSP\nDIMENSION : {}\nEDGE_WEIGHT_TYPE : EUC_2D\nNODE_COORD_SECTION\n".format(len(xy), len(xy)))
+        for i, p in enumerate(xy):
+            f.write("{} {} {}\n".format(i + 1, p[0], p[1]))
+        f.write("EOF\n")
+    return path
+
+def setup_factor(n, k, directory):
+    return diff(n, k)
+
+def setup_splitter(n, k, directory):
+    return diff(n, k)
+
+def setup_kmoves(n, k, directory):
+    return (Splitter(*diff(n, k)).get_segments(),)
+
+def setup_consume(n, k, directory):
+    return consume_inputs(Splitter(*diff(n, k)).get_segments())
+
+def setup_kmove(n, k, directory):
+    tour, new_tour = diff(n, k)
+    common, dels, adds = tour_util.factor(tour, new_tour)
+    return tour, {'dels': list(dels), 'adds': list(adds)}
+
+def setup_improve(n, k, directory):
+    xy = convex_xy(n)
+    return xy, tour_util.default(xy)
+
+def setup_read(n, k, directory):
+    return (write_instance(random_xy(n), directory),)
+
+def run_splitter(tour, new_tour):
+    return Splitter(tour, new_tour).get_segments()
+
+# name: (setup, run, n sizes, k sizes, expected exponent in n, expected exponent in k).
+# an exponent of None is not checked; empty sizes mean the dimension is not swept.
+STAGES = {
+    'tour_util.factor': (setup_factor, tour_util.factor, N_SIZES, K_SIZES, 1, 0),
+    'Splitter.get_segments': (setup_splitter, run_splitter, N_SIZES, K_SIZES, 1, None),
+    'segments_to_kmoves': (setup_kmoves, solver.segments_to_kmoves, N_SIZES, K_SIZES, 0, 1),
+    'consume_all_trivials': (setup_consume, solver.consume_all_trivials, N_SIZES, K_SIZES, 0, 1),
+    'is_feasible': (setup_kmove, solver.is_feasible, N_SIZES, K_SIZES, 1, 0),
+    'perform_kmove': (setup_kmove, solver.perform_kmove, N_SIZES, K_SIZES, 1, 0),
+    'two_opt.improve': (setup_improve, two_opt.improve, IMPROVE_SIZES, [], 2, None),
+    'reader.read_xy': (setup_read, reader.read_xy, N_SIZES, [], 1, None),
+}
+
+def measure(run, args):
+    """Median of REPEAT timings of run, averaged over enough calls to take about MIN_TIME.
+    Each call gets a fresh copy of args, since some stages modify them; copying is not timed.
+    As in timeit, garbage collection is disabled while timing, and the call count is calibrated
+    after a warm-up call (imports, caches, compilation).
+    """
+    run(*copy.deepcopy(args))
+    a = copy.deepcopy(args)
+    start = time.perf_counter()
+    run(*a)
+    number = min(MAX_NUMBER, max(1, int(MIN_TIME / (time.perf_counter() - start))))
+    timings = []
+    for _ in range(REPEAT):
+        copies = [copy.deepcopy(args) for _ in range(number)]
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for a in copies:
+                run(*a)
+            timings.append((time.perf_counter() - start) / number)
+        finally:
+            if gc_enabled:
+                gc.enable()
+    timings.sort()
+    return timings[len(timings) // 2]
+
+def slope(points):
+    """Least squares slope of log(time) against log(size)."""
+    xs = [math.log(x) for x, t in points]
+    ys = [math.log(t) for x, t in points]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    return sum([(x - mx) * (y - my) for x, y in zip(xs, ys)]) / sum([(x - mx) ** 2 for x in xs])
+
+def sweep(name, directory):
+    """Returns a tuple of: dict of 'n' and 'k' scaling curves as lists of (size, seconds), and
+    dict of the inputs used for each (dimension, size), for re-measurement.
+    """
+    setup, run, n_sizes, k_sizes, n_exponent, k_exponent = STAGES[name]
+    # same synthetic inputs for a stage regardless of which other stages run.
+    random.seed(name)
+    curves = {'n': [], 'k': []}
+    inputs = {}
+    for n in n_sizes:
+        inputs[('n', n)] = setup(n, FIXED_K, directory)
+        curves['n'].append((n, measure(run, inputs[('n', n)])))
+    for k in k_sizes:
+        inputs[('k', k)] = setup(FIXED_N, k, directory)
+        curves['k'].append((k, measure(run, inputs[('k', k)])))
+    return curves, inputs
+
+def check_scaling(name, curves):
+    """Returns a list of (dimension, fitted exponent) for fitted exponents outside tolerance."""
+    setup, run, n_sizes, k_sizes, n_exponent, k_exponent = STAGES[name]
+    suspects = []
+    for dimension, expected in (('n', n_exponent), ('k', k_exponent)):
+        if expected is None or len(curves[dimension]) < 2:
+            continue
+        fitted = slope(curves[dimension])
+        print('    {} exponent: {:.2f} (expected {})'.format(dimension, fitted, expected))
+        if abs(fitted - expected) > EXPONENT_TOLERANCE:
+            suspects.append((dimension, fitted))
+    return suspects
+
+def confirm_scaling(name, suspects, inputs):
+    """Re-measures the curves of suspect exponents CONFIRMATIONS times on the same inputs, and
+    returns a list of messages for those outside tolerance every time. Called after all stages
+    have run, like confirm_regressions.
+    """
+    setup, run, n_sizes, k_sizes, n_exponent, k_exponent = STAGES[name]
+    problems = []
+    for dimension, fitted in suspects:
+        expected = n_exponent if dimension == 'n' else k_exponent
+        sizes = n_sizes if dimension == 'n' else k_sizes
+        refitted = []
+        for _ in range(CONFIRMATIONS):
+            refitted.append(slope([(size, measure(run, inputs[(dimension, size)])) for size in sizes]))
+            if abs(refitted[-1] - expected) <= EXPONENT_TOLERANCE:
+                break
+        exponents = ', '.join(['{:.2f}'.format(x) for x in [fitted] + refitted])
+        if abs(refitted[-1] - expected) > EXPONENT_TOLERANCE:
+            problems.append('{}: {} exponent {}, expected {}'.format(name, dimension, exponents, expected))
+        else:
+            print('{}: {} exponent {}, not confirmed on re-measurement'.format(name, dimension, exponents))
+    return problems
+
+def check_baseline(name, curves, baseline):
+    """Returns a list of (dimension, size, seconds, baseline seconds) for timings slower than
+    baseline by REGRESSION_FACTOR.
+    """
+    suspects = []
+    if name not in baseline:
+        return suspects
+    for dimension in ('n', 'k'):
+        old = dict([(size, t) for size, t in baseline[name].get(dimension, [])])
+        for size, t in curves[dimension]:
+            if size in old and t > REGRESSION_FACTOR * old[size]:
+                suspects.append((dimension, size, t, old[size]))
+    return suspects
+
+def confirm_regressions(name, suspects, inputs):
+    """Re-measures suspected regressions of a stage CONFIRMATIONS times on the same inputs, and
+    returns a list of messages for those that are slow every time. Called after all stages have
+    run, so that a slow period of the machine (e.g. other load) does not affect all measurements.
+    """
+    setup, run, n_sizes, k_sizes, n_exponent, k_exponent = STAGES[name]
+    problems = []
+    for dimension, size, t, old in suspects:
+        # all stops at the first re-measurement that is not slow.
+        if all(measure(run, inputs[(dimension, size)]) > REGRESSION_FACTOR * old for _ in range(CONFIRMATIONS)):
+            problems.append('{}: {}={} took {:.3g}s, baseline {:.3g}s'.format(name, dimension, size, t, old))
+        else:
+            print('{}: {}={} took {:.3g}s, not confirmed on re-measurement'.format(name, dimension, size, t))
+    return problems
+
+def profile(name, directory, profile_dir):
+    """Writes cProfile stats for one run of the stage at its largest size."""
+    setup, run, n_sizes, k_sizes, n_exponent, k_exponent = STAGES[name]
+    k = max(k_sizes) if k_sizes else FIXED_K
+    args = setup(max(n_sizes), k, directory)
+    profiler = cProfile.Profile()
+    profiler.runcall(run, *args)
+    path = os.path.join(profile_dir, '{}.prof'.format(name))
+    profiler.dump_stats(path)
+    print('    profile written to {}'.format(path))
+
+def main(argv):
+    global REPEAT
+    parser = argparse.ArgumentParser(description = 'Pipeline stage microbenchmarks.')
+    parser.add_argument('--save-baseline', metavar = 'FILE', help = 'write timings to FILE.')
+    parser.add_argument('--compare', metavar = 'FILE', help = 'flag regressions against timings in FILE.')
+    parser.add_argument('--profile-dir', metavar = 'DIR', help = 'write a cProfile .prof file per stage to DIR.')
+    parser.add_argument('--stage', action = 'append', choices = sorted(STAGES), help = 'only run the given stage(s).')
+    parser.add_argument('--quick', action = 'store_true', help = 'fewer repeats, for a fast smoke run.')
+    args = parser.parse_args(argv)
+    if args.quick:
+        REPEAT = 3
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    if args.profile_dir:
+        os.makedirs(args.profile_dir, exist_ok = True)
+    print('kernels: {}'.format('numba' if accel.AVAILABLE else 'python'))
+    results = {}
+    problems = []
+    stage_inputs = {}
+    scaling_suspects = {}
+    baseline_suspects = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.stage or STAGES:
+            print(name)
+            curves, inputs = sweep(name, directory)
+            for dimension in ('n', 'k'):
+                for size, t in curves[dimension]:
+                    print('    {}={}: {:.3g}s'.format(dimension, size, t))
+            stage_inputs[name] = inputs
+            scaling_suspects[name] = check_scaling(name, curves)
+            baseline_suspects[name] = check_baseline(name, curves, baseline)
+            results[name] = curves
+            if args.profile_dir:
+                profile(name, directory, args.profile_dir)
+        for name in stage_inputs:
+            problems += confirm_scaling(name, scaling_suspects[name], stage_inputs[name])
+            problems += confirm_regressions(name, baseline_suspects[name], stage_inputs[name])
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent = 2)
+    for p in problems:
+        print('FLAGGED: {}'.format(p))
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+# Held-Karp lower bound via subgradient optimization of minimum 1-trees, and alpha-nearness
+# candidate lists derived from the resulting 1-tree.
+# During the ascent, minimum spanning trees are computed over a sparse k-nearest-neighbor graph,
+# falling back to a dense computation only if the sparse graph is disconnected. The returned
+# bound is always computed from an exact (dense) 1-tree, so it is valid for any neighbor graph.
+
+import basic
+import heapq
+import math
+import reader
+
+# node excluded from the spanning tree and attached to it by its 2 cheapest edges.
+SPECIAL_NODE = 0
+
+def nearest_neighbors(xy, k):
+    """Returns, for each node, a list of its k nearest node ids (nearest first)."""
+    n = len(xy)
+    k = min(k, n - 1)
+    neighbors = []
+    for i in range(n):
+        others = (j for j in range(n) if j != i)
+        neighbors.append(heapq.nsmallest(k, others, key = lambda j: basic.distance(xy, i, j)))
+    return neighbors
+
+def sparse_edges(neighbors):
+    """Symmetric edge set (min id first) of a neighbor list graph."""
+    edges = set()
+    for i, near in enumerate(neighbors):
+        for j in near:
+            edges.add((min(i, j), max(i, j)))
+    return edges
+
+def cost(xy, pi, i, j):
+    """Edge cost transformed by the node penalties pi."""
+    return basic.distance(xy, i, j) + pi[i] + pi[j]
+
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def kruskal(xy, pi, edges, nodes):
+    """Minimum spanning tree over the given edges, restricted to nodes.
+    Returns a list of (cost, i, j) tree edges, or None if the edges do not span nodes.
+    """
+    weighted = [(cost(xy, pi, i, j), i, j) for i, j in edges if i in nodes and j in nodes]
+    weighted.sort()
+    parent = {i: i for i in nodes}
+    tree = []
+    for c, i, j in weighted:
+        ri = find(parent, i)
+        rj = find(parent, j)
+        if ri == rj:
+            continue
+        parent[ri] = rj
+        tree.append((c, i, j))
+        if len(tree) == len(nodes) - 1:
+            return tree
+    return None
+
+def prim(xy, pi, nodes):
+    """Dense minimum spanning tree over nodes. Returns a list of (cost, i, j) tree edges."""
+    nodes = list(nodes)
+    start = nodes[0]
+    best = {i: (cost(xy, pi, start, i), start) for i in nodes[1:]}
+    tree = []
+    while best:
+        i = min(best, key = lambda x: best[x][0])
+        c, j = best.pop(i)
+        tree.append((c, j, i))
+        for other in best:
+            oc = cost(xy, pi, i, other)
+            if oc < best[other][0]:
+                best[other] = (oc, i)
+    return tree
+
+def one_tree(xy, pi, edges):
+    """Minimum 1-tree: a spanning tree on all nodes except SPECIAL_NODE, plus the 2 cheapest edges
+    incident to SPECIAL_NODE.
+    The spanning tree is restricted to edges unless edges is None, in which case it is exact
+    (dense). A restricted tree can be heavier than the exact one.
+    Returns a tuple of: transformed 1-tree weight, node degrees, and list of (cost, i, j) edges.
+    """
+    n = len(xy)
+    nodes = set(range(n))
+    nodes.remove(SPECIAL_NODE)
+    tree = None if edges is None else kruskal(xy, pi, edges, nodes)
+    if tree is None:
+        tree = prim(xy, pi, nodes)
+    special = heapq.nsmallest(2, ((cost(xy, pi, SPECIAL_NODE, j), SPECIAL_NODE, j) for j in nodes))
+    tree += special
+    degrees = [0] * n
+    weight = 0
+    for c, i, j in tree:
+        degrees[i] += 1
+        degrees[j] += 1
+        weight += c
+    assert(len(tree) == n)
+    return weight, degrees, tree
+
+def nearest_neighbor_tour_length(xy):
+    """Length of a greedy nearest neighbor tour, used as the default subgradient upper bound."""
+    n = len(xy)
+    unvisited = set(range(1, n))
+    current = 0
+    L = 0
+    while unvisited:
+        nearest = min(unvisited, key = lambda j: basic.distance(xy, current, j))
+        L += basic.distance(xy, current, nearest)
+        unvisited.remove(nearest)
+        current = nearest
+    return L + basic.distance(xy, current, 0)
+
+def subgradient(xy, neighbors, iterations = 1000, upper_bound = None):
+    """Subgradient optimization of the node penalties pi (Polyak step sizes).
+    The ascent uses 1-trees over the neighbor graph; the returned bound is the exact minimum
+    1-tree weight at the best penalties found (or at pi = 0, if that is higher).
+    Returns a tuple of: the Held-Karp lower bound (rounded up, since distances are integral),
+    and the penalties pi that achieved it.
+    """
+    n = len(xy)
+    assert(n > 2)
+    if upper_bound is None:
+        upper_bound = nearest_neighbor_tour_length(xy)
+    edges = sparse_edges(neighbors)
+    pi = [0.0] * n
+    best = -math.inf
+    best_pi = pi[:]
+    scale = 2.0
+    period = max(n // 2, 10)
+    stale = 0
+    for _ in range(iterations):
+        weight, degrees, tree = one_tree(xy, pi, edges)
+        w = weight - 2 * sum(pi)
+        if w > best + 1e-9:
+            best = w
+            best_pi = pi[:]
+            stale = 0
+        else:
+            stale += 1
+            if stale >= period:
+                scale /= 2
+                stale = 0
+        v = [d - 2 for d in degrees]
+        norm = sum([x * x for x in v])
+        if norm == 0:
+            # the 1-tree is a tour, and therefore optimal.
+            break
+        step = scale * (upper_bound - w) / norm
+        if step < 1e-6:
+            break
+        for i in range(n):
+            pi[i] += step * v[i]
+    # the sparse 1-trees only guide the ascent: they can overestimate the minimum 1-tree weight,
+    # so the returned bound is taken from the exact 1-tree at best_pi. With a very sparse graph
+    # the ascent can be misled, so fall back to the plain (pi = 0) 1-tree bound if it is higher.
+    weight, degrees, tree = one_tree(xy, best_pi, None)
+    bound = weight - 2 * sum(best_pi)
+    zero_pi = [0.0] * n
+    zero_weight, degrees, tree = one_tree(xy, zero_pi, None)
+    if zero_weight > bound:
+        bound = zero_weight
+        best_pi = zero_pi
+    return math.ceil(bound - 1e-6), best_pi
+
+def lower_bound(xy, k = 10, iterations = 1000, upper_bound = None):
+    """Held-Karp lower bound on the optimal tour length."""
+    return subgradient(xy, nearest_neighbors(xy, k), iterations, upper_bound)[0]
+
+def gap(length, bound):
+    """Optimality gap of a tour length relative to a lower bound, as a fraction of the bound."""
+    assert(bound > 0)
+    return (length - bound) / bound
+
+def root_tree(tree, n):
+    """Roots the spanning tree part of a 1-tree (edges not incident to SPECIAL_NODE).
+    Returns a tuple of: parent, depth, and cost of the edge to parent, indexed by node id.
+    """
+    adjacency = {}
+    for c, i, j in tree:
+        if i == SPECIAL_NODE or j == SPECIAL_NODE:
+            continue
+        adjacency.setdefault(i, []).append((c, j))
+        adjacency.setdefault(j, []).append((c, i))
+    parent = [None] * n
+    depth = [0] * n
+    up_cost = [0] * n
+    root = 1 if SPECIAL_NODE == 0 else 0
+    parent[root] = root
+    stack = [root]
+    while stack:
+        i = stack.pop()
+        for c, j in adjacency.get(i, []):
+            if parent[j] is None:
+                parent[j] = i
+                depth[j] = depth[i] + 1
+                up_cost[j] = c
+                stack.append(j)
+    return parent, depth, up_cost
+
+def beta(parent, depth, up_cost, i, j):
+    """Maximum edge cost on the tree path between i and j."""
+    b = -math.inf
+    while i != j:
+        if depth[i] < depth[j]:
+            i, j = j, i
+        b = max(b, up_cost[i])
+        i = parent[i]
+    return b
+
+def alpha_candidates(xy, pi, neighbors, k = 5):
+    """Candidate lists ranked by alpha-nearness: the increase in minimum 1-tree weight
+    when the 1-tree is forced to contain an edge.
+    Alpha values are only computed for edges in the neighbor graph.
+    Ties are broken by distance. Returns, for each node, a list of up to k node ids.
+    """
+    n = len(xy)
+    weight, degrees, tree = one_tree(xy, pi, sparse_edges(neighbors))
+    parent, depth, up_cost = root_tree(tree, n)
+    special_edges = [(c, j if i == SPECIAL_NODE else i) for c, i, j in tree if SPECIAL_NODE in (i, j)]
+    special_adjacent = set([j for c, j in special_edges])
+    special_max = max([c for c, j in special_edges])
+    pool = [set(near) for near in neighbors]
+    for i, near in enumerate(neighbors):
+        for j in near:
+            pool[j].add(i)
+    candidates = []
+    for i in range(n):
+        ranked = []
+        for j in pool[i]:
+            c = cost(xy, pi, i, j)
+            if i == SPECIAL_NODE or j == SPECIAL_NODE:
+                other = j if i == SPECIAL_NODE else i
+                alpha = 0 if other in special_adjacent else c - special_max
+            else:
+                alpha = c - beta(parent, depth, up_cost, i, j)
+            ranked.append((alpha, basic.distance(xy, i, j), j))
+        ranked.sort()
+        candidates.append([j for alpha, d, j in ranked[:k]])
+    return candidates
+
+def bound_and_candidates(xy, k = 5, pool = 10, iterations = 1000, upper_bound = None):
+    """Returns a tuple of: Held-Karp lower bound and alpha-nearness candidate lists of size k,
+    chosen among the pool nearest neighbors of each node.
+    """
+    neighbors = nearest_neighbors(xy, pool)
+    bound, pi = subgradient(xy, neighbors, iterations, upper_bound)
+    return bound, alpha_candidates(xy, pi, neighbors, k)
+
+if __name__ == "__main__":
+    xy = reader.read_xy("problems/xqf131.tsp")
+    bound, candidates = bound_and_candidates(xy)
+    print('held-karp lower bound: {}'.format(bound))
+    for i in range(5):
+        print('{}: {}'.format(i, candidates[i]))
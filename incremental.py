@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+# Incremental re-optimization of an optimized tour after a small change to the instance:
+# node insertions, deletions, and coordinate updates.
+# The tour is repaired with cheapest insertion over candidate edges, the k-nearest-neighbor
+# candidate lists are patched, and the hill climb only runs around the touched nodes.
+# The tour is kept as successor / predecessor links, so removals and insertions are O(1), and
+# 2-opt moves reverse the shorter side of the tour. Neighbor queries use a uniform grid, and a
+# reverse index finds the lists that refer to moved or deleted nodes. Updates therefore
+# cost time proportional to the change and the local search it triggers (2-opt
+# reversals excepted, which can be up to n / 2 long). Deletions keep ids in [0, n) by
+# renumbering the highest ids into the freed ones, rather than shifting all ids.
+
+import basic
+import heapq
+import held_karp
+import math
+import random
+import reader
+import tour_util
+import two_opt
+from collections import deque
+
+# double bridge perturbations are confined to this many tour nodes after a touched node.
+WINDOW = 30
+# average number of nodes per grid cell.
+CELL_OCCUPANCY = 2
+
+class DynamicTour:
+    """An optimized tour of xy, kept optimized through small changes with update."""
+    def __init__(self, xy, tour, k = 8, neighbors = None):
+        """neighbors are k-nearest-neighbor candidate lists sorted nearest first
+        (held_karp.nearest_neighbors), and are computed if not given.
+        """
+        self.xy = xy[:]
+        self.k = k
+        n = len(xy)
+        self.succ = [0] * n
+        self.pred = [0] * n
+        for i in range(n):
+            self.succ[tour[i - 1]] = tour[i]
+            self.pred[tour[i]] = tour[i - 1]
+        self.length = tour_util.length(xy, tour)
+        xs = [p[0] for p in xy]
+        ys = [p[1] for p in xy]
+        area = max(max(xs) - min(xs), 1) * max(max(ys) - min(ys), 1)
+        self.size = math.sqrt(area * CELL_OCCUPANCY / n)
+        self.build_index(held_karp.nearest_neighbors(xy, k) if neighbors is None else [x[:] for x in neighbors])
+
+    @property
+    def tour(self):
+        """The tour as a sequence of node ids, starting from node 0."""
+        tour = [0]
+        i = self.succ[0]
+        while i != 0:
+            tour.append(i)
+            i = self.succ[i]
+        return tour
+
+    def build_index(self, neighbors):
+        """Sets neighbor lists, and rebuilds the reverse index and the grid from scratch."""
+        n = len(self.xy)
+        self.neighbors = neighbors
+        self.reverse = [set() for _ in range(n)]
+        for i in range(n):
+            for j in neighbors[i]:
+                self.reverse[j].add(i)
+        self.grid = {}
+        self.extent = None
+        for i in range(n):
+            self.grid_add(i)
+
+    def cell(self, i):
+        return (math.floor(self.xy[i][0] / self.size), math.floor(self.xy[i][1] / self.size))
+
+    def grid_add(self, i):
+        cx, cy = self.cell(i)
+        self.grid.setdefault((cx, cy), set()).add(i)
+        if self.extent is None:
+            self.extent = [cx, cx, cy, cy]
+        else:
+            self.extent = [min(self.extent[0], cx), max(self.extent[1], cx), min(self.extent[2], cy), max(self.extent[3], cy)]
+
+    def grid_remove(self, i):
+        cell = self.cell(i)
+        self.grid[cell].remove(i)
+        if not self.grid[cell]:
+            del self.grid[cell]
+
+    def ring(self, cx, cy, r):
+        """Grid cells at Chebyshev distance r from cell (cx, cy)."""
+        if r == 0:
+            return [(cx, cy)]
+        cells = [(cx + dx, cy + dy) for dx in range(-r, r + 1) for dy in (-r, r)]
+        cells += [(cx + dx, cy + dy) for dx in (-r, r) for dy in range(-r + 1, r)]
+        return cells
+
+    def max_ring(self, cx, cy):
+        """Ring beyond which there are no occupied cells."""
+        x0, x1, y0, y1 = self.extent
+        return max(cx - x0, x1 - cx, cy - y0, y1 - cy, 0)
+
+    def nearest(self, i, k, exclude = ()):
+        """k nearest nodes to i (nearest first), not in exclude, searched ring by ring on the grid.
+        Nodes beyond ring r are at least (r * size) away, which bounds the search.
+        """
+        cx, cy = self.cell(i)
+        limit = self.max_ring(cx, cy)
+        found = []
+        r = 0
+        while True:
+            for cell in self.ring(cx, cy, r):
+                for j in self.grid.get(cell, ()):
+                    if j != i and j not in exclude:
+                        found.append((basic.distance(self.xy, i, j), j))
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= r * self.size - 0.5:
+                    break
+            if r >= limit:
+                break
+            r += 1
+        found.sort()
+        return [j for d, j in found[:k]]
+
+    def within(self, i, radius):
+        """Nodes in grid cells that can be within radius of node i."""
+        cx, cy = self.cell(i)
+        rings = min(math.ceil(radius / self.size) + 1, self.max_ring(cx, cy))
+        nodes = []
+        for r in range(rings + 1):
+            for cell in self.ring(cx, cy, r):
+                nodes += self.grid.get(cell, ())
+        return nodes
+
+    def set_neighbors(self, i, near):
+        for j in self.neighbors[i]:
+            self.reverse[j].discard(i)
+        self.neighbors[i] = near
+        for j in near:
+            self.reverse[j].add(i)
+
+    def update(self, insertions = (), deletions = (), moves = None, iterations = None):
+        """Applies the change and re-optimizes around it.
+        insertions are (x, y) coordinates of new nodes, deletions are node ids, and moves map
+        node ids to new (x, y) coordinates. Ids refer to the tour before the update.
+        iterations is the number of local double bridge perturbations (default: 5 per touched node).
+        Returns a dict mapping each deleted id to None, and each renumbered id to its new id
+        (see compact); other ids are unchanged, and inserted nodes take the ids after them.
+        """
+        moves = moves or {}
+        deleted = set(deletions)
+        assert(not deleted & set(moves))
+        assert(len(self.xy) - len(deleted) + len(insertions) > 7)
+        # nodes whose tour neighbors change, and so should be re-examined by local search.
+        joined = set()
+        # nodes whose neighbor lists refer to deleted or moved nodes.
+        stale = set()
+        for i in list(deleted) + list(moves):
+            joined.update(self.remove_from_tour(i))
+            stale.update(self.reverse[i])
+        for i in moves:
+            self.grid_remove(i)
+            self.xy[i] = (float(moves[i][0]), float(moves[i][1]))
+            self.grid_add(i)
+        mapping = self.compact(deleted) if deleted else {}
+        changed = [mapping.get(i, i) for i in moves]
+        for p in insertions:
+            self.xy.append((float(p[0]), float(p[1])))
+            i = len(self.xy) - 1
+            self.succ.append(None)
+            self.pred.append(None)
+            self.neighbors.append([])
+            self.reverse.append(set())
+            self.grid_add(i)
+            changed.append(i)
+        stale = set([mapping.get(i, i) for i in stale if i not in deleted]) - set(changed)
+        self.update_neighbors(changed, stale)
+        pending = set(changed)
+        for i in changed:
+            pending.remove(i)
+            self.insert_into_tour(i, pending)
+        touched = set([mapping.get(i, i) for i in joined if i not in deleted]) | set(changed)
+        if touched:
+            self.optimize(touched, 5 * len(touched) if iterations is None else iterations)
+        return mapping
+
+    def remove_from_tour(self, i):
+        """Removes node i from the tour. Returns its former tour neighbors."""
+        prev = self.pred[i]
+        next = self.succ[i]
+        self.length += basic.distance(self.xy, prev, next) - basic.distance(self.xy, prev, i) - basic.distance(self.xy, i, next)
+        self.succ[prev] = next
+        self.pred[next] = prev
+        self.succ[i] = None
+        self.pred[i] = None
+        return [x for x in (prev, next) if x != i]
+
+    def compact(self, deleted):
+        """Drops deleted nodes, which must already be removed from the tour. Ids stay in [0, n):
+        the highest surviving ids are renumbered into the ids freed below the new n.
+        Returns a dict mapping each deleted id to None, and each renumbered id to its new id.
+        """
+        mapping = dict([(i, None) for i in deleted])
+        for i in deleted:
+            self.grid_remove(i)
+            for j in self.reverse[i]:
+                self.neighbors[j].remove(i)
+            self.reverse[i] = set()
+            self.set_neighbors(i, [])
+        n = len(self.xy) - len(deleted)
+        holes = sorted([i for i in deleted if i < n])
+        movers = [i for i in range(n, len(self.xy)) if i not in deleted]
+        for old, new in zip(movers, holes):
+            mapping[old] = new
+            self.grid_remove(old)
+            self.xy[new] = self.xy[old]
+            self.grid_add(new)
+            next = self.succ[old]
+            prev = self.pred[old]
+            self.succ[new] = next
+            self.pred[new] = prev
+            # moved nodes are out of the tour until reinserted.
+            if next is not None:
+                self.pred[next] = new
+                self.succ[prev] = new
+            near = self.neighbors[old]
+            self.set_neighbors(old, [])
+            self.set_neighbors(new, near)
+            for j in list(self.reverse[old]):
+                self.neighbors[j][self.neighbors[j].index(old)] = new
+                self.reverse[new].add(j)
+            self.reverse[old] = set()
+        del self.xy[n:]
+        del self.succ[n:]
+        del self.pred[n:]
+        del self.neighbors[n:]
+        del self.reverse[n:]
+        return mapping
+
+    def update_neighbors(self, changed, stale):
+        """Recomputes the lists of changed (moved or inserted) and stale nodes from the grid, then
+        adds changed nodes to the lists of nearby nodes they now belong in. Only nodes within
+        twice a changed node's k-th neighbor distance are considered for that, so an isolated
+        node whose neighbors are all far away may miss a closer changed node.
+        """
+        k = min(self.k, len(self.xy) - 1)
+        for i in list(stale) + changed:
+            self.set_neighbors(i, self.nearest(i, k))
+        changed_set = set(changed)
+        for c in changed:
+            near = self.neighbors[c]
+            radius = 2 * basic.distance(self.xy, c, near[-1]) if near else 0
+            for i in self.within(c, radius):
+                if i == c or i in changed_set or c in self.neighbors[i]:
+                    continue
+                near = self.neighbors[i]
+                if len(near) < k or basic.distance(self.xy, i, c) < basic.distance(self.xy, i, near[-1]):
+                    self.set_neighbors(i, heapq.nsmallest(k, near + [c], key = lambda j: basic.distance(self.xy, i, j)))
+
+    def insert_into_tour(self, c, pending):
+        """Cheapest insertion of c, over tour edges incident to its candidate neighbors
+        (or to its nearest node in the tour, if all of them are pending insertion).
+        """
+        xy = self.xy
+        anchors = [a for a in self.neighbors[c] if a not in pending]
+        if not anchors:
+            anchors = self.nearest(c, 1, pending)
+        best = None
+        for a in anchors:
+            for u, v in ((self.pred[a], a), (a, self.succ[a])):
+                cost = basic.distance(xy, u, c) + basic.distance(xy, c, v) - basic.distance(xy, u, v)
+                if best is None or cost < best[0]:
+                    best = (cost, u, v)
+        cost, u, v = best
+        self.succ[u] = c
+        self.pred[c] = u
+        self.succ[c] = v
+        self.pred[v] = c
+        self.length += cost
+
+    def reverse_path(self, a, b, shorter = True):
+        """Reverses the tour path a -> ... -> b (in succ order). If shorter, reverses the
+        complementary path instead when that is shorter, which gives the same cycle.
+        Returns the (first, last) nodes of the path actually reversed, as now in succ order;
+        reversing that path with shorter = False undoes the reversal exactly.
+        """
+        succ = self.succ
+        pred = self.pred
+        if shorter:
+            # walk both paths in step, so finding the shorter one costs its length.
+            x = pred[a]
+            y = succ[b]
+            u = a
+            v = y
+            while u != b and v != x:
+                u = succ[u]
+                v = succ[v]
+            if u != b:
+                a, b = y, x
+        x = pred[a]
+        y = succ[b]
+        i = a
+        while True:
+            next = succ[i]
+            succ[i], pred[i] = pred[i], succ[i]
+            if i == b:
+                break
+            i = next
+        succ[x] = b
+        pred[b] = x
+        succ[a] = y
+        pred[y] = a
+        return b, a
+
+    def optimize_local(self, active, log):
+        """Candidate 2-opt that only examines moves from active nodes; nodes at the ends of
+        performed moves become active (don't-look bits). Reversals are appended to log.
+        Returns the total improvement.
+        """
+        xy = self.xy
+        queue = deque()
+        queued = set()
+        for t in active:
+            if t not in queued:
+                queue.append(t)
+                queued.add(t)
+        total_improvement = 0
+        while queue:
+            t1 = queue.popleft()
+            queued.remove(t1)
+            for forward in (True, False):
+                t2 = self.succ[t1] if forward else self.pred[t1]
+                d12 = basic.distance(xy, t1, t2)
+                improved = False
+                for t3 in self.neighbors[t1]:
+                    d13 = basic.distance(xy, t1, t3)
+                    if d13 >= d12:
+                        continue
+                    t4 = self.succ[t3] if forward else self.pred[t3]
+                    if t3 == t2 or t4 == t1:
+                        continue
+                    improvement = d12 + basic.distance(xy, t3, t4) - d13 - basic.distance(xy, t2, t4)
+                    if improvement > 0:
+                        # new edges (t1, t3) and (t2, t4).
+                        if forward:
+                            log.append(self.reverse_path(t2, t3))
+                        else:
+                            log.append(self.reverse_path(t3, t2))
+                        total_improvement += improvement
+                        for t in (t1, t2, t3, t4):
+                            if t not in queued:
+                                queue.append(t)
+                                queued.add(t)
+                        improved = True
+                        break
+                if improved:
+                    break
+        return total_improvement
+
+    def local_double_bridge(self, i):
+        """Double bridge among the WINDOW tour nodes following node i.
+        Returns a tuple of: length delta, the moved segment endpoints, and the links they had.
+        """
+        xy = self.xy
+        succ = self.succ
+        pred = self.pred
+        window = min(WINDOW, len(xy) - 1)
+        nodes = [i]
+        for _ in range(window):
+            nodes.append(succ[nodes[-1]])
+        a, b, c = sorted(random.sample(range(1, window), 3))
+        # segments A = nodes[1..a], B = nodes[a+1..b], C = nodes[b+1..c] become C B A.
+        ends = [nodes[x] for x in (0, 1, a, a + 1, b, b + 1, c, c + 1)]
+        saved = [(x, succ[x], pred[x]) for x in ends]
+        removed = [(0, 1), (a, a + 1), (b, b + 1), (c, c + 1)]
+        added = [(0, b + 1), (c, a + 1), (b, 1), (a, c + 1)]
+        delta = sum([basic.distance(xy, nodes[u], nodes[v]) for u, v in added])
+        delta -= sum([basic.distance(xy, nodes[u], nodes[v]) for u, v in removed])
+        for u, v in added:
+            succ[nodes[u]] = nodes[v]
+            pred[nodes[v]] = nodes[u]
+        return delta, ends, saved
+
+    def optimize(self, touched, iterations):
+        """Local 2-opt from the touched nodes, then local perturbations kept only if they improve.
+        Rejected perturbations are undone by replaying the reversal log backwards, and restoring
+        the links of the double bridge endpoints.
+        """
+        self.length -= self.optimize_local(touched, [])
+        touched = list(touched)
+        for _ in range(iterations):
+            delta, ends, saved = self.local_double_bridge(random.choice(touched))
+            log = []
+            delta -= self.optimize_local(ends, log)
+            if delta < 0:
+                self.length += delta
+                continue
+            for a, b in reversed(log):
+                self.reverse_path(a, b, False)
+            for x, s, p in saved:
+                self.succ[x] = s
+                self.pred[x] = p
+
+if __name__ == "__main__":
+    xy = reader.read_xy("problems/xqf131.tsp")
+    neighbors = held_karp.nearest_neighbors(xy, 8)
+    tour, length = two_opt.optimize(xy, tour_util.default(xy), neighbors)
+    dynamic_tour = DynamicTour(xy, tour, 8, neighbors)
+    mapping = dynamic_tour.update(insertions = [(30.5, 40.5), (100.0, 10.0)], deletions = [3, 50], moves = {7: (60.0, 60.0)})
+    assert(dynamic_tour.length == tour_util.length(dynamic_tour.xy, dynamic_tour.tour))
+    assert(sorted(dynamic_tour.tour) == list(range(len(dynamic_tour.xy))))
+    print('length before: {}, after update: {}'.format(length, dynamic_tour.length))
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
+import accel
 import reader
 import two_opt
+import held_karp
 import basic
 import tour_util
-import plot_util
 import sys
 import random
 from splitter import Splitter
@@ -175,6 +176,13 @@ def perform_kmove_on_adjacency_map(adjacency_map, kmove):
         assert(len(adjacency_map[i]) == 2)
 
 def walk_adjacency_map(adjacency_map):
+    """Walks the adjacency map from node 0. Uses the compiled kernel if available."""
+    if accel.AVAILABLE:
+        return accel.walk_adjacency_map(adjacency_map)
+    return walk_adjacency_map_python(adjacency_map)
+
+def walk_adjacency_map_python(adjacency_map):
+    """Reference implementation of walk_adjacency_map."""
     start = 0
     i = adjacency_map[start][0]
     prev = start
@@ -191,9 +199,18 @@ def walk_adjacency_map(adjacency_map):
     return tour
 
 def perform_kmove(tour, kmove):
+    """Returns the walk of tour after performing kmove. Uses the compiled kernel if available.
+    The walk is shorter than tour if kmove is infeasible (creates subtours).
+    """
+    if accel.AVAILABLE:
+        return accel.perform_kmove(tour, kmove)
+    return perform_kmove_python(tour, kmove)
+
+def perform_kmove_python(tour, kmove):
+    """Reference implementation of perform_kmove."""
     adj = make_adjacency_map(tour)
     perform_kmove_on_adjacency_map(adj, kmove)
-    return walk_adjacency_map(adj)
+    return walk_adjacency_map_python(adj)
 
 def is_feasible(tour, kmove):
     return len(perform_kmove(tour, kmove)) == len(tour)
@@ -267,55 +284,74 @@ def segments_to_beneficial_kmoves(xy, segments, tour):
     beneficial_kmoves.sort(key = lambda x: x[0], reverse = True)
     return beneficial_kmoves
 
-def perturbed_hill_climb(xy, tour):
+def reached_target(length, bound, max_gap):
+    """Stopping criterion: known target length reached, or within max_gap of a lower bound."""
+    if length <= TARGET_LENGTH:
+        return True
+    return bound is not None and held_karp.gap(length, bound) <= max_gap
+
+def perturbation_step(xy, tour, best_length, candidates = None, verbose = True, stop = None):
+    """One double bridge perturbation and 2-opt of tour, followed by applying the beneficial
+    independent k-moves found in the difference between the 2 local optima.
+    stop is an optional function checked during the 2-opt; if it returns True, the step is
+    abandoned and tour is returned unchanged.
+    Returns a tuple of: new best tour, and its length.
+    """
+    new_tour, naive_new_length = two_opt.optimize(xy, tour_util.double_bridge(tour), candidates, verbose, stop) # double bridge
+    if stop and stop():
+        return tour, best_length
+    #test_tour = tour[:]
+    #random.shuffle(test_tour)
+    #new_tour, naive_new_length = two_opt.optimize(xy, test_tour) # random restart
+    segments = Splitter(tour, new_tour).get_segments()
+    kmoves = segments_to_beneficial_kmoves(xy, segments, tour)
+    naive_gain = best_length - naive_new_length
+    # There may be cases where naive gain is more than decomposed gains:
+    # decomposed gains currently only return moves that can be independently performed.
+    # Infeasible moves that are improvements but only can be combined with other moves to become feasible
+    # (a potentially computationally expensive search) wil be excluded from the decomposed moves.
+    dd_gain = 0 # gain due to decomposed kmoves.
+    for k in kmoves:
+        if verbose:
+            print('    trying {}-opt move with gain {}'.format(len(k[1]['adds']), k[0]))
+        test_tour = perform_kmove(tour, k[1])
+        if len(test_tour) == len(tour):
+            tour = test_tour
+            best_length -= k[0]
+            dd_gain += k[0]
+    if naive_gain > dd_gain:
+        if verbose:
+            print('naive_gain ({}) greater than dd_gain ({})'.format(naive_gain, dd_gain))
+        tour = new_tour
+        best_length = naive_new_length
+    if verbose and dd_gain > 0 and dd_gain > naive_gain:
+        print('    dd gain {} greater than naive gain {}'.format(dd_gain, naive_gain))
+    return tour, best_length
+
+def perturbed_hill_climb(xy, tour, candidates = None, bound = None, max_gap = 0):
     tries = 0
     success = 0
     best_length = tour_util.length(xy, tour)
     while True:
-        new_tour, naive_new_length = two_opt.optimize(xy, tour_util.double_bridge(tour)) # double bridge
-        #test_tour = tour[:]
-        #random.shuffle(test_tour)
-        #new_tour, naive_new_length = two_opt.optimize(xy, test_tour) # random restart
-        segments = Splitter(tour, new_tour).get_segments()
-        kmoves = segments_to_beneficial_kmoves(xy, segments, tour)
-        max_gain = 0
-        if kmoves:
-            max_gain = sum([k[0] for k in kmoves])
-        naive_gain = best_length - naive_new_length
-        # There may be cases where naive gain is more than decomposed gains:
-        # decomposed gains currently only return moves that can be independently performed.
-        # Infeasible moves that are improvements but only can be combined with other moves to become feasible
-        # (a potentially computationally expensive search) wil be excluded from the decomposed moves.
-        dd_gain = 0 # gain due to decomposed kmoves.
-        if kmoves:
-            for k in kmoves:
-                print('    trying {}-opt move with gain {}'.format(len(k[1]['adds']), k[0]))
-                test_tour = perform_kmove(tour, k[1])
-                if len(test_tour) == len(tour):
-                    tour = test_tour
-                    best_length -= k[0]
-                    dd_gain += k[0]
-        if naive_gain > dd_gain:
-            print('naive_gain ({}) greater than dd_gain ({})'.format(naive_gain, dd_gain))
-            tour = new_tour
-            best_length = naive_new_length
-        if naive_gain > 0 or dd_gain > 0:
+        tour, new_length = perturbation_step(xy, tour, best_length, candidates)
+        if new_length < best_length:
             success += 1
-        if dd_gain > 0 and dd_gain > naive_gain:
-            print('    dd gain {} greater than naive gain {}'.format(dd_gain, naive_gain))
+        best_length = new_length
         tries += 1
         current_length = basic.tour_length(xy, tour)
         assert(best_length == current_length)
-        if current_length <= TARGET_LENGTH:
+        if reached_target(current_length, bound, max_gap):
             break
         print('current best: {} (iteration {}), improvement rate: {}'.format(best_length, tries, success / tries))
+        if bound is not None:
+            print('    gap to lower bound {}: {:.4%}'.format(bound, held_karp.gap(best_length, bound)))
 
-def perturbed_hill_climb_naive(xy, tour):
+def perturbed_hill_climb_naive(xy, tour, candidates = None, bound = None, max_gap = 0):
     tries = 0
     success = 0
     best_length = tour_util.length(xy, tour)
     while True:
-        new_tour, naive_new_length = two_opt.optimize(xy, tour_util.double_bridge(tour)) # double bridge
+        new_tour, naive_new_length = two_opt.optimize(xy, tour_util.double_bridge(tour), candidates) # double bridge
         #test_tour = tour[:]
         #random.shuffle(test_tour)
         #new_tour, naive_new_length = two_opt.optimize(xy, test_tour) # random restart
@@ -327,7 +363,7 @@ def perturbed_hill_climb_naive(xy, tour):
         tries += 1
         current_length = basic.tour_length(xy, tour)
         assert(best_length == current_length)
-        if current_length <= TARGET_LENGTH:
+        if reached_target(current_length, bound, max_gap):
             break
         print('current best: {} (iteration {}), improvement rate: {}'.format(best_length, tries, success / tries))
 
@@ -336,6 +372,8 @@ if __name__ == "__main__":
     print('stopping at target length {}'.format(TARGET_LENGTH))
     problem_name = 'xqf131'
     xy = reader.read_xy("problems/{}.tsp".format(problem_name))
+    bound, candidates = held_karp.bound_and_candidates(xy)
+    print('held-karp lower bound: {}'.format(bound))
     tour = tour_util.default(xy)
-    tour, improvement = two_opt.optimize(xy, tour)
-    perturbed_hill_climb(xy, tour)
+    tour, improvement = two_opt.optimize(xy, tour, candidates)
+    perturbed_hill_climb(xy, tour, candidates, bound)
@@ -1,5 +1,6 @@
 #/usr/bin/env python3
 
+import accel
 import tour_util
 import basic
 
@@ -10,6 +11,13 @@ def swap(tour, i, j):
     return new_tour
 
 def improve(xy, tour):
+    """First improving sequential 2-opt move. Uses the compiled kernel if available."""
+    if accel.AVAILABLE:
+        return accel.improve(xy, tour)
+    return improve_python(xy, tour)
+
+def improve_python(xy, tour):
+    """Reference implementation of improve."""
     n = len(tour)
     for i in range(n):
         ilen = basic.distance(xy, tour[i], tour[(i+1)%n])
@@ -23,12 +31,65 @@ def improve(xy, tour):
                 return new_tour, improvement
     return tour, 0
 
-def optimize(xy, tour):
-    new_tour, improvement = improve(xy, tour)
-    total_improvement = improvement
-    while improvement > 0:
-        new_tour, improvement = improve(xy, new_tour)
-        total_improvement += improvement
+def improve_candidates(xy, tour, candidates):
+    """Like improve, but only considers 2-opt moves that add an edge from a node to one of its
+    candidates (e.g. held_karp.alpha_candidates). Uses the compiled kernel if available.
+    """
+    if accel.AVAILABLE:
+        return accel.improve_candidates(xy, tour, candidates)
+    return improve_candidates_python(xy, tour, candidates)
+
+def improve_candidates_python(xy, tour, candidates):
+    """Reference implementation of improve_candidates."""
+    n = len(tour)
+    position = [0] * n
+    for i in range(n):
+        position[tour[i]] = i
+    for i in range(n):
+        t1 = tour[i]
+        for direction in (1, -1):
+            t2 = tour[(i + direction) % n]
+            d12 = basic.distance(xy, t1, t2)
+            for t3 in candidates[t1]:
+                d13 = basic.distance(xy, t1, t3)
+                if d13 >= d12:
+                    continue
+                j = position[t3]
+                t4 = tour[(j + direction) % n]
+                improvement = d12 + basic.distance(xy, t3, t4) - d13 - basic.distance(xy, t2, t4)
+                if improvement > 0:
+                    # edges are (a, a + 1) and (b, b + 1) in tour positions.
+                    a, b = (i, j) if direction == 1 else ((i - 1) % n, (j - 1) % n)
+                    new_tour = swap(tour, min(a, b), max(a, b))
+                    assert(tour != new_tour)
+                    return new_tour, improvement
+    return tour, 0
+
+def optimize(xy, tour, candidates = None, verbose = True, stop = None):
+    """Applies improving 2-opt moves until none remain.
+    If candidates are given, only moves adding candidate edges are considered.
+    stop is an optional function checked before each move (each batch of accel.STOP_CHECK_MOVES
+    moves, with the compiled kernels); if it returns True, the current (improved, but not
+    necessarily 2-optimal) tour is returned.
+    """
+    if accel.AVAILABLE:
+        # the compiled kernels check stop between batches of moves (accel.STOP_CHECK_MOVES).
+        if candidates is None:
+            new_tour, total_improvement = accel.optimize(xy, tour, stop)
+        else:
+            new_tour, total_improvement = accel.optimize_candidates(xy, tour, candidates, stop)
+    else:
+        if candidates is None:
+            step = improve_python
+        else:
+            step = lambda xy, tour: improve_candidates_python(xy, tour, candidates)
+        new_tour = tour
+        total_improvement = 0
+        improvement = 1
+        while improvement > 0 and not (stop and stop()):
+            new_tour, improvement = step(xy, new_tour)
+            total_improvement += improvement
     new_length = tour_util.length(xy, new_tour)
-    print('optimized length: {}'.format(new_length))
+    if verbose:
+        print('optimized length: {}'.format(new_length))
     return new_tour, new_length